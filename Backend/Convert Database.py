@@ -1,68 +1,168 @@
 from __future__ import annotations
-import argparse, logging, sqlite3
+import argparse, logging, os, sqlite3
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
+from urllib.parse import urlparse
 import tldextract                                    # pip install tldextract
 
 DEFAULT_BATCH = 10_000
+MIN_SQLITE = (3, 33, 0)              # UPDATE … FROM
+CHUNKS_PER_WORKER = 4                # parse tasks per worker per batch
 
-SCHEMA_ALTERS = [
-    "ALTER TABLE websites ADD COLUMN domain TEXT",
-    "ALTER TABLE websites ADD COLUMN subdomain TEXT",
-]
+# WAL + relaxed sync: each batch commit appends to the WAL instead of
+# rewriting the rollback journal and fsync'ing twice
+PRAGMA_SQL = """PRAGMA journal_mode=WAL;
+                PRAGMA synchronous=NORMAL;
+                PRAGMA temp_store=MEMORY;
+                PRAGMA cache_size=-262144;
+                PRAGMA mmap_size=30000000000;
+                PRAGMA busy_timeout=60000;"""
 
-# composite-key update prevents clobbering                           ─┐
-UPDATE_SQL = """UPDATE websites SET domain = ?, subdomain = ?
-                WHERE item = ? AND website = ?;"""                   #│
+# one extractor per process, built from the bundled suffix-list snapshot
+# (no network fetch, no disk cache) instead of tldextract's lazy global;
+# set up by _init_extractor in the parent before the pool starts, so forked
+# workers inherit the parsed suffix list and the initializer is a no-op there
+_EXTRACT: tldextract.TLDExtract | None = None
+_SINGLE_TLDS: frozenset[str] = frozenset()
+
+def _single_label_tlds(extract: tldextract.TLDExtract) -> frozenset[str]:
+    """TLDs with no multi-label public suffix beneath them (com, org, de …).
+
+    For these the registrable domain is always the last two labels, so the
+    host can be split by hand; ccTLDs like ``uk`` (co.uk, ac.uk …) are left
+    out and go through tldextract.
+    """
+    tlds = extract.tlds
+    nested = {t.rsplit(".", 1)[-1] for t in tlds if "." in t}
+    return frozenset(t for t in tlds if "." not in t) - nested
+
+def _init_extractor() -> None:
+    global _EXTRACT, _SINGLE_TLDS
+    if _EXTRACT is None:
+        _EXTRACT = tldextract.TLDExtract(suffix_list_urls=(), cache_dir=None,
+                                         include_psl_private_domains=False)
+        _SINGLE_TLDS = _single_label_tlds(_EXTRACT)   # .tlds parses the PSL now
+
+NEW_COLUMNS = {"domain": "TEXT", "subdomain": "TEXT"}
+
+# partial, covering index over the rows still to do: SELECT_SQL becomes an
+# index scan, and the index shrinks as rows get their domain filled in
+PENDING_INDEX_SQL = """CREATE INDEX IF NOT EXISTS idx_websites_null_domain
+                       ON websites(website, item) WHERE domain IS NULL;"""
+
+# each batch is staged in a temp table and applied with one set-based
+# UPDATE … FROM instead of 10k single-row UPDATEs
+STAGE_SQL = """CREATE TEMP TABLE IF NOT EXISTS _upd (
+                   item TEXT, website TEXT, domain TEXT, subdomain TEXT);
+               CREATE INDEX IF NOT EXISTS temp._upd_key ON _upd(item, website);"""
+STAGE_INSERT_SQL = "INSERT INTO _upd VALUES (?, ?, ?, ?);"
+
+# composite-key join prevents clobbering                             ─┐
+UPDATE_SQL = """UPDATE websites SET domain = _upd.domain, subdomain = _upd.subdomain
+                FROM   _upd
+                WHERE  _upd.item = websites.item
+                  AND  _upd.website = websites.website;"""           #│
 
 # stop fetching rows that have no URL                               ─┘
 SELECT_SQL = """SELECT item, website
                 FROM   websites
                 WHERE  domain IS NULL
                   AND  website IS NOT NULL
-                  AND  website <> ''
-                LIMIT  ?;"""
+                  AND  website <> '';"""
 
 def ensure_columns(conn: sqlite3.Connection) -> None:
     cur = conn.cursor()
-    cur.execute("PRAGMA table_info(websites);")
-    current = {row[1] for row in cur.fetchall()}
-    for stmt in SCHEMA_ALTERS:
-        col = stmt.split()[5]            # “domain” / “subdomain” not “COLUMN”
+    current = {r[0] for r in cur.execute("SELECT name FROM pragma_table_info('websites');")}
+    for col, typ in NEW_COLUMNS.items():
         if col not in current:
             logging.info("Adding column %s", col)
-            cur.execute(stmt)
+            cur.execute(f"ALTER TABLE websites ADD COLUMN {col} {typ};")
             conn.commit()
-            current.add(col)             # keep PRAGMA cache in sync :contentReference[oaicite:0]{index=0}
+    cur.execute(PENDING_INDEX_SQL)
+    conn.commit()
+
+def classify_host(host: str) -> int:
+    """Offset where the registrable domain starts in `host`, or -1 on a miss.
+
+    Only answers for ``[sub.]name.tld`` hosts whose TLD is in _SINGLE_TLDS;
+    everything else (multi-label suffixes, IPs, empty labels) is a miss and
+    goes to tldextract. Works on offsets from str.rfind so no label list is
+    built per row.
+    """
+    dot = host.rfind(".")
+    if dot <= 0 or host[dot + 1:] not in _SINGLE_TLDS or ".." in host or host[0] == ".":
+        return -1
+    return host.rfind(".", 0, dot) + 1   # 0 when there is no subdomain
 
 def extract_parts(url: str) -> tuple[str | None, str | None]:
-    tld = tldextract.extract(url)
+    if "://" not in url and "." not in url:   # no scheme, no dot → not a host
+        return '', None
+    try:
+        host = urlparse(url).hostname    # lower-cased, port/userinfo stripped
+    except ValueError:                   # e.g. malformed IPv6 literal
+        host = None
+    if host:
+        start = classify_host(host)
+        if start >= 0:                   # fast path: plain <name>.<tld> hosts
+            return host[start:], None if host[:start] in ("", "www.") else host
+    tld = _EXTRACT(url)
     if not tld.suffix:                   # unrecognised host → mark as done
         return '', None                  # empty string is our sentinel
-    reg = f"{tld.domain}.{tld.suffix}"
-    sub = f"{tld.subdomain}.{reg}" if tld.subdomain and tld.subdomain.lower() != "www" else None
+    # lower-cased like the fast path's urlparse hostname, so lookups match either way
+    reg = f"{tld.domain}.{tld.suffix}".lower()
+    sub = f"{tld.subdomain}.{reg}".lower() if tld.subdomain and tld.subdomain.lower() != "www" else None
     return reg, sub
 
+def apply_batch(conn: sqlite3.Connection, upd: sqlite3.Cursor, rows: list, parsed) -> int:
+    data = [(item, url, dom, sub)
+            for (item, url), (dom, sub) in zip(rows, parsed)]
+    upd.execute("DELETE FROM _upd;")
+    upd.executemany(STAGE_INSERT_SQL, data)
+    upd.execute(UPDATE_SQL)
+    conn.commit()
+    return len(data)
+
 def backfill(conn: sqlite3.Connection, batch: int) -> None:
+    conn.executescript(STAGE_SQL)
     sel, upd = conn.cursor(), conn.cursor()
     total = 0
-    while True:
-        sel.execute(SELECT_SQL, (batch,))
-        rows = sel.fetchall()
-        if not rows:                     # nothing left to do → exit
-            break
-        data = []
-        for item, url in rows:
-            dom, sub = extract_parts(url)
-            data.append((dom, sub, item, url))
-        upd.executemany(UPDATE_SQL, data)
-        conn.commit()
-        total += len(data)
-        logging.info("Updated %d rows (running total %d)", len(data), total)
+    sel.arraysize = batch                # fetchmany() pulls one batch per call
+    workers = os.cpu_count() or 1
+    _init_extractor()                    # parse the PSL once, before forking
+    # parsing is CPU-bound Python (GIL-held) → processes; DB writes stay here
+    with ProcessPoolExecutor(max_workers=workers,
+                             initializer=_init_extractor) as pool:
+        while True:
+            # one streaming scan per pass; updated rows drop out of the partial
+            # index, so a second pass only picks up anything the scan missed
+            before = total
+            pending = None               # previous batch, parsing in the pool
+            sel.execute(SELECT_SQL)
+            while rows := sel.fetchmany():
+                # map() submits every chunk up front, so this batch parses
+                # while the previous one is written below
+                parsed = pool.map(extract_parts, [url for _, url in rows],
+                                  chunksize=max(1, len(rows) // (workers * CHUNKS_PER_WORKER)))
+                if pending:
+                    n = apply_batch(conn, upd, *pending)
+                    total += n
+                    logging.info("Updated %d rows (running total %d)", n, total)
+                pending = rows, parsed
+            if pending:
+                n = apply_batch(conn, upd, *pending)
+                total += n
+                logging.info("Updated %d rows (running total %d)", n, total)
+            if total == before:          # nothing left to do → exit
+                break
     logging.info("✓ Finished – %d rows enriched", total)
 
 def main(db: Path, batch: int):
+    if sqlite3.sqlite_version_info < MIN_SQLITE:
+        raise SystemExit(f"SQLite {'.'.join(map(str, MIN_SQLITE))}+ is required (UPDATE … FROM); "
+                         f"this Python's sqlite3 uses {sqlite3.sqlite_version}")
     logging.basicConfig(level=logging.INFO, format="%(levelname)s | %(message)s")
     with sqlite3.connect(db) as conn:
+        conn.executescript(PRAGMA_SQL)
         ensure_columns(conn)
         backfill(conn, batch)
 